@@ -1,148 +1,289 @@
 import streamlit as st
-import yahoo_fin.stock_info as si
+import yfinance as yf
+from curl_cffi import requests as curl_requests
 import pandas as pd
-import plotly.express as px
+import numpy as np
+from numba import njit
 from datetime import date, timedelta
+from pathlib import Path
+import hashlib
+import os
+import time
+import uuid
 
 # --- Configuration ---
 st.set_page_config(page_title="Portfolio Allocation Dashboard", page_icon=":chart_with_upwards_trend:")
 
+# --- Data Fetching ---
+PRICE_CACHE_DIR = Path("~/.streamlit_price_cache").expanduser() # Parquet copies of fetched prices, survives restarts
+PRICE_CACHE_TTL = 86400 # Daily prices don't change intraday
+
+def price_cache_path(tickers, start, end):
+    key = f"{','.join(tickers)}|{start.isoformat()}|{end.isoformat()}"
+    return PRICE_CACHE_DIR / f"{hashlib.sha1(key.encode()).hexdigest()}.parquet"
+
+def write_price_cache(cache_path, data):
+    # Best-effort: prune expired files, then write via a temp file so a crash never leaves a truncated parquet behind
+    tmp_path = cache_path.with_name(f"{cache_path.stem}.{uuid.uuid4().hex}.tmp")
+    try:
+        PRICE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        now = time.time()
+        for old_path in PRICE_CACHE_DIR.iterdir():
+            if now - old_path.stat().st_mtime >= PRICE_CACHE_TTL:
+                old_path.unlink(missing_ok=True)
+        data.to_parquet(tmp_path, compression="zstd")
+        os.replace(tmp_path, cache_path)
+    except Exception:
+        tmp_path.unlink(missing_ok=True) # The disk cache is only an optimization
+
+@st.cache_resource
+def yahoo_session():
+    # One HTTP session (connection pool, cookies, crumb) shared by every rerun and user
+    return curl_requests.Session(impersonate="chrome")
+
+def canonical_range(start, end):
+    # Widen to whole weeks (Monday..Sunday) so nearby date picks share one cached download.
+    # The exclusive end never goes past today, so today's unfinished bar isn't fetched and cached as a close.
+    week_start = pd.Timestamp(start).to_period("W").start_time.date()
+    week_end = pd.Timestamp(end).to_period("W").end_time.date()
+    return week_start, min(week_end, date.today())
+
+@st.cache_data(ttl=PRICE_CACHE_TTL, show_spinner="Fetching prices…", max_entries=32)
+def fetch_historical_data(tickers, start, end):
+    # Returns (prices, dates, columns) - failures raise instead, since st.cache_data doesn't cache exceptions and a retry refetches.
+    # Plain NumPy arrays are much cheaper than a DataFrame for st.cache_data to copy on every hit.
+    combined_data = None
+    cache_path = price_cache_path(tickers, start, end)
+    if cache_path.exists() and time.time() - cache_path.stat().st_mtime < PRICE_CACHE_TTL:
+        try:
+            combined_data = pd.read_parquet(cache_path)
+        except Exception:
+            cache_path.unlink(missing_ok=True) # Unreadable (e.g. truncated) - drop it and refetch below
+
+    if combined_data is None:
+        try:
+            # One batched request for all tickers instead of one scrape per ticker
+            raw = yf.download(list(tickers), start=start, end=end, threads=True, group_by="column", auto_adjust=True, actions=False, progress=False, session=yahoo_session())
+        except Exception as e:
+            raise RuntimeError(f"Error fetching data for {', '.join(tickers)}: {e}") from e
+
+        if raw is None or raw.empty or "Close" not in raw.columns.get_level_values(0):
+            raise RuntimeError("No data available for the selected assets and timeframe.")
+        # Close is already split/dividend adjusted; tickers that failed come back as all-NaN columns
+        combined_data = raw["Close"].dropna(axis=1, how="all")
+        for ticker in tickers:
+            if ticker not in combined_data.columns:
+                raise RuntimeError(f"Data issue for {ticker}. Please check ticker/timeframe.")
+        # float32 is plenty for daily prices and halves the cache and everything downstream
+        combined_data = combined_data[list(tickers)].astype(np.float32)
+        write_price_cache(cache_path, combined_data)
+
+    prices = np.ascontiguousarray(combined_data.to_numpy(dtype=np.float32))
+    return prices, combined_data.index.to_numpy(), tuple(combined_data.columns)
+
+
+# --- Portfolio Calculation (Corrected using returns) ---
+@njit(cache=True, fastmath=True) # Compiled once, reused across reruns
+def simulate_pv(R, w, init):
+    # Compound the weighted daily returns; kept as an explicit loop so rebalancing/costs can be added per day.
+    # Returns (portfolio value, daily portfolio returns), both filled in the same pass.
+    T, N = R.shape
+    pv = np.empty(T + 1)
+    daily = np.empty(T)
+    pv[0] = init
+    for t in range(T):
+        r = 0.0
+        for k in range(N):
+            r += w[k] * R[t, k]
+        daily[t] = r
+        pv[t + 1] = pv[t] * (1.0 + r)
+    return pv, daily
+
+@st.cache_data(max_entries=32) # Returns don't depend on the weights, so weight changes skip this stage
+def compute_returns(prices, dates):
+    # Returns (daily asset returns, portfolio value dates - the first price date followed by the return dates,
+    # digest of both) - the digest lets later caches key on the data itself without re-hashing the arrays
+    # Forward-fill gaps (e.g. equities over weekends while BTC trades), as pct_change's default padding did
+    rows = np.where(~np.isnan(prices), np.arange(len(prices))[:, None], 0)
+    np.maximum.accumulate(rows, axis=0, out=rows)
+    filled = prices[rows, np.arange(prices.shape[1])]
+
+    # Calculate daily returns, reusing one buffer rather than allocating per operation
+    asset_returns = np.divide(filled[1:], filled[:-1])
+    asset_returns -= 1.0
+    complete = ~np.isnan(asset_returns).any(axis=1) # Same rows dropna() would keep
+    asset_returns = asset_returns[complete] # Boolean indexing already yields a fresh contiguous array
+    pv_dates = np.concatenate((dates[:1], dates[1:][complete]))
+    returns_digest = hashlib.sha1(asset_returns.tobytes() + pv_dates.tobytes()).hexdigest()
+    return asset_returns, pv_dates, returns_digest
+
+@st.cache_data(ttl=PRICE_CACHE_TTL, max_entries=256)
+def compute_portfolio(_asset_returns, returns_digest, weights, initial_investment):
+    # Returns (portfolio value, daily portfolio returns) for weights aligned to the return columns.
+    # The return matrix is identified by its content digest (from compute_returns) so it is never hashed itself.
+    # Portfolio value is accumulated in float64 so float32 inputs don't compound rounding error
+    return simulate_pv(_asset_returns, weights, float(initial_investment))
+
+
+# --- Chart Downsampling ---
+MAX_CHART_POINTS = 2000 # Long ranges are reduced to about this many points before going to the browser
+
+def downsample_minmax(x, y, max_points=MAX_CHART_POINTS):
+    # Keep each bucket's min and max (plus the endpoints) so peaks and drawdowns still show after reduction
+    if len(y) <= max_points:
+        return x, y
+    bucket = -(-len(y) // (max_points // 2))
+    padded = np.full(bucket * -(-len(y) // bucket), np.nan)
+    padded[:len(y)] = y
+    blocks = padded.reshape(-1, bucket)
+    offsets = np.arange(len(blocks)) * bucket
+    keep = np.unique(np.concatenate((offsets + np.nanargmin(blocks, axis=1), offsets + np.nanargmax(blocks, axis=1), [0, len(y) - 1])))
+    return x[keep], y[keep]
+
+
 # --- Sidebar ---
 st.sidebar.header("Portfolio Settings")
 
 # Asset Selection - Fixed to SPY, GLD, BTC
 selected_assets = ["SPY", "GLD", "BTC-USD"] # Fixed assets
-asset_tickers = selected_assets # For data fetching
 asset_names = ["S&P 500 (SPY)", "Gold (GLD)", "Bitcoin (BTC-USD)"] # For display
 
-# Timeframe Selection
-today = date.today()
-default_start_date = today - timedelta(days=5 * 365)
-start_date = st.sidebar.date_input("Start Date", default_start_date)
-end_date = st.sidebar.date_input("End Date", today)
-
-# Portfolio Allocation - Double-Ended Slider
-st.sidebar.subheader("Allocation Weights (%)")
-allocation_range = st.sidebar.slider(
-    "SPY / GLD Allocation Range (%)",
-    0.0, 100.0, (40.0, 70.0) # Default range: SPY 40%, GLD (70-40)=30%, BTC (100-70)=30%
-)
-
-spy_weight = allocation_range[0]
-gld_weight = allocation_range[1] - allocation_range[0]
-btc_weight = 100.0 - allocation_range[1]
-
-asset_weights = {
-    "SPY": spy_weight,
-    "GLD": gld_weight,
-    "BTC-USD": btc_weight
-}
-
-# Display Weights (for verification)
-st.sidebar.write(f"**Allocation:**")
-st.sidebar.write(f"- {asset_names[0]}: {spy_weight:.1f}%")
-st.sidebar.write(f"- {asset_names[1]}: {gld_weight:.1f}%")
-st.sidebar.write(f"- {asset_names[2]}: {btc_weight:.1f}%")
-st.sidebar.write(f"**Total: {(spy_weight + gld_weight + btc_weight):.1f}%**")
+# Dates live in a form so editing them only reruns once "Update" is pressed
+with st.sidebar.form("portfolio_form"):
+    # Timeframe Selection - defaults computed once per session, so they also don't shift (and reset the widgets) at midnight
+    if "default_start_date" not in st.session_state:
+        st.session_state.default_end_date = date.today()
+        st.session_state.default_start_date = st.session_state.default_end_date - timedelta(days=5 * 365)
+    start_date = st.date_input("Start Date", st.session_state.default_start_date)
+    end_date = st.date_input("End Date", st.session_state.default_end_date)
 
+    st.form_submit_button("Update")
 
-# --- Main Panel ---
-st.title("Simplified Portfolio Allocation Dashboard")
-st.write("Visualize portfolio growth with SPY, GLD, and BTC allocations using a range slider.")
+show_debug = st.sidebar.checkbox("Debug tables")
 
-if start_date >= end_date:
-    st.error("Error: Start date must be before end date.")
-else:
-    # --- Data Fetching ---
-    @st.cache_data
-    def fetch_historical_data(tickers, start, end):
-        all_data = {}
-        for ticker in tickers:
-            try:
-                data = si.get_data(ticker=ticker, start_date=start, end_date=end)
-                if data is None or data.empty or 'adjclose' not in data.columns:
-                    st.error(f"Data issue for {ticker}. Please check ticker/timeframe.")
-                    return None
-                all_data[ticker] = data['adjclose']
-            except Exception as e:
-                st.error(f"Error fetching data for {ticker}: {e}")
-                return None
-
-        if not all_data:
-            return None
-        combined_data = pd.DataFrame(all_data)
-        #st.write("### Fetched Data:")  # Debugging output
-        #st.write(combined_data)  # Debugging output
-        return combined_data
-
-    data_df = fetch_historical_data(asset_tickers, start_date, end_date)
-
-    if data_df is None:
-        st.error("Data fetch failed for one or more assets. Check tickers/timeframe.")
-    elif data_df.empty:
-        st.error("No data available for the selected assets and timeframe.")
-    else:
-        data_df.columns = asset_tickers
 
-        # --- Portfolio Calculation (Corrected using returns) ---
-        asset_returns = data_df.pct_change().dropna() # Calculate daily returns
-        #st.write("### Asset Returns:") # Debugging output
-        #st.write(asset_returns) # Debugging output
+# --- Allocation Panel ---
+# A fragment reruns on its own when the slider moves, skipping the fetch and returns stages of the script
+@st.fragment
+def weight_panel(prices, dates, asset_returns, pv_dates, returns_digest):
+    # Portfolio Allocation - Double-Ended Slider
+    st.subheader("Allocation Weights (%)")
+    # Slider in a form so a batch of adjustments reruns the fragment once, on "Apply"
+    with st.form("allocation_form"):
+        allocation_range = st.slider(
+            "SPY / GLD Allocation Range (%)",
+            0.0, 100.0, (40.0, 70.0) # Default range: SPY 40%, GLD (70-40)=30%, BTC (100-70)=30%
+        )
 
-        portfolio_value = pd.DataFrame(index=asset_returns.index)
-        portfolio_value['Portfolio'] = 0.0
+        st.form_submit_button("Apply")
 
-        normalized_weights = {}
-        total_weight_for_norm = sum(asset_weights.values()) # Use calculated weights for normalization
-        if total_weight_for_norm > 0:
-             for asset, weight in asset_weights.items():
-                 normalized_weights[asset] = weight / total_weight_for_norm
-        else:
-            num_assets = len(selected_assets)
-            if num_assets > 0:
-                for asset in selected_assets:
-                    normalized_weights[asset] = 1.0 / num_assets
+    spy_weight = allocation_range[0]
+    gld_weight = allocation_range[1] - allocation_range[0]
+    btc_weight = 100.0 - allocation_range[1]
 
+    asset_weights = np.array([spy_weight, gld_weight, btc_weight], dtype=np.float32) # Positional, aligned to selected_assets
 
-        initial_investment = 10000
-        portfolio_value['Portfolio'].iloc[0] = initial_investment # Initialize portfolio value
-
-        # Calculate portfolio value day by day using returns
-        for i in range(1, len(portfolio_value)):
-            daily_portfolio_return = 0
-            for asset in selected_assets:
-                if asset in normalized_weights:
-                    daily_portfolio_return += asset_returns[asset].iloc[i-1] * normalized_weights[asset]
-            portfolio_value['Portfolio'].iloc[i] = portfolio_value['Portfolio'].iloc[i-1] * (1 + daily_portfolio_return)
+    # Display Weights (for verification)
+    st.write(f"**Allocation:**")
+    st.write(f"- {asset_names[0]}: {spy_weight:.1f}%")
+    st.write(f"- {asset_names[1]}: {gld_weight:.1f}%")
+    st.write(f"- {asset_names[2]}: {btc_weight:.1f}%")
+    st.write(f"**Total: {(spy_weight + gld_weight + btc_weight):.1f}%**")
 
-        #st.write("### Portfolio Value:") # Debugging output
-        #st.write(portfolio_value) # Debugging output
+    # Canonical, order-independent key so reordered selections share the same entry
+    weights_key = tuple(sorted(zip(selected_assets, asset_weights.round(4).tolist())))
 
+    # Skip the simulation when only an unrelated widget (e.g. the debug checkbox) changed
+    input_key = (returns_digest, weights_key)
+    if st.session_state.get("last_key") == input_key and "last_result" in st.session_state:
+        pv, metrics = st.session_state["last_result"]
+    else:
+        # Normalized weight vector, positionally aligned to the price columns
+        total_weight_for_norm = asset_weights.sum()
+        weight_vec = asset_weights / total_weight_for_norm if total_weight_for_norm > 0 else np.full_like(asset_weights, 1.0 / len(asset_weights))
 
-        # --- Plotting ---
-        fig = px.line(portfolio_value, x=portfolio_value.index, y='Portfolio',
-                      title=f'Portfolio Performance ({start_date.strftime("%Y-%m-%d")} to {end_date.strftime("%Y-%m-%d")})',
-                      labels={'Portfolio': 'Portfolio Value ($)', 'Date': 'Date'})
-        st.plotly_chart(fig, use_container_width=True)
+        initial_investment = 10000
+        pv, daily_port_ret = compute_portfolio(asset_returns, returns_digest, weight_vec, initial_investment)
 
         # --- Performance Metrics ---
-        st.subheader("Portfolio Performance Metrics")
-        returns = portfolio_value['Portfolio'].pct_change().dropna()
-
-        cumulative_return = (portfolio_value['Portfolio'].iloc[-1] / portfolio_value['Portfolio'].iloc[0]) - 1 if not portfolio_value.empty else 0
-        annual_return = (1 + cumulative_return)**(252/len(returns)) - 1 if len(returns) > 0 else 0
-        stdev = returns.std() if not returns.empty else 0
+        cumulative_return = (pv[-1] / pv[0]) - 1 if len(pv) > 0 else 0
+        annual_return = (1 + cumulative_return)**(252/len(daily_port_ret)) - 1 if len(daily_port_ret) > 0 else 0
+        stdev = daily_port_ret.std(ddof=1) if len(daily_port_ret) > 1 else 0
         sharpe_ratio = annual_return / stdev if stdev > 0 else 0
 
         # Drawdown Calculation
-        rolling_max = portfolio_value['Portfolio'].cummax()
-        drawdown = portfolio_value['Portfolio'] / rolling_max - 1.0
-        max_drawdown = drawdown.min() if not drawdown.empty else 0
+        peak = np.maximum.accumulate(pv)
+        max_drawdown = float((pv / peak - 1.0).min()) if len(pv) > 0 else 0
+
+        metrics = (cumulative_return, annual_return, stdev, sharpe_ratio, max_drawdown)
+        st.session_state["last_key"] = input_key
+        st.session_state["last_result"] = (pv, metrics)
+
+    cumulative_return, annual_return, stdev, sharpe_ratio, max_drawdown = metrics
+
+    # Debugging output - only serialized to the browser when requested
+    if show_debug:
+        with st.expander("Debug"):
+            st.write("### Fetched Data:")
+            st.write(pd.DataFrame(prices, index=dates, columns=selected_assets))
+            st.write("### Portfolio Value:")
+            st.write(pd.DataFrame({'Portfolio': pv}, index=pv_dates))
+
+
+    # --- Plotting ---
+    st.caption(f'Portfolio Performance ({start_date.strftime("%Y-%m-%d")} to {end_date.strftime("%Y-%m-%d")})')
+    # Vega-Lite + Arrow, far lighter than a Plotly figure; plain arrays avoid building a DataFrame just to plot
+    chart_dates, chart_values = downsample_minmax(pv_dates, pv)
+    st.line_chart({'Date': chart_dates, 'Portfolio': chart_values}, x='Date', y='Portfolio', x_label='Date', y_label='Portfolio Value ($)')
+
+    st.subheader("Portfolio Performance Metrics")
+
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Cumulative Return", f"{cumulative_return*100:.2f}%" if not pd.isna(cumulative_return) else "NaN")
+    col2.metric("Annualized Return", f"{annual_return*100:.2f}%" if not pd.isna(annual_return) else "NaN")
+    col3.metric("Volatility (Std Dev)", f"{stdev*100:.2f}%" if not pd.isna(stdev) else "NaN")
+    col4.metric("Max Drawdown", f"{max_drawdown*100:.2f}%" if not pd.isna(max_drawdown) else "NaN")
+
+    st.write(f"Sharpe Ratio (assuming risk-free rate of 0): **{sharpe_ratio:.2f}**" if not pd.isna(sharpe_ratio) else f"Sharpe Ratio (assuming risk-free rate of 0): **NaN**")
+
+
+# --- Main Panel ---
+st.title("Simplified Portfolio Allocation Dashboard")
+st.write("Visualize portfolio growth with SPY, GLD, and BTC allocations using a range slider.")
+
+if start_date >= end_date:
+    st.error("Error: Start date must be before end date.")
+else:
+    # Canonical, order-independent key so reordered selections share cache entries
+    tickers_key = tuple(sorted(set(selected_assets)))
+
+    # Skip fetching and returns when only an unrelated widget (e.g. the debug checkbox) changed
+    data_key = (tickers_key, start_date, end_date)
+    if st.session_state.get("last_data_key") == data_key and "last_data" in st.session_state:
+        data = st.session_state["last_data"]
+    else:
+        data = None
+        try:
+            prices, dates, columns = fetch_historical_data(tickers_key, *canonical_range(start_date, end_date))
+        except RuntimeError as e:
+            prices = None
+            st.error(str(e))
+            st.error("Data fetch failed for one or more assets. Check tickers/timeframe.")
+
+        if prices is not None:
+            # Trim the week-aligned download back to the requested range (end date is exclusive, as in yfinance)
+            in_range = (dates >= np.datetime64(start_date)) & (dates < np.datetime64(end_date))
+            prices, dates = prices[in_range], dates[in_range]
+
+            if len(prices) == 0:
+                st.error("No data available for the selected assets and timeframe.")
+            else:
+                prices = prices[:, [columns.index(ticker) for ticker in selected_assets]] # Restore display order
+                asset_returns, pv_dates, returns_digest = compute_returns(prices, dates)
 
-        col1, col2, col3, col4 = st.columns(4)
-        col1.metric("Cumulative Return", f"{cumulative_return*100:.2f}%" if not pd.isna(cumulative_return) else "NaN")
-        col2.metric("Annualized Return", f"{annual_return*100:.2f}%" if not pd.isna(annual_return) else "NaN")
-        col3.metric("Volatility (Std Dev)", f"{stdev*100:.2f}%" if not pd.isna(stdev) else "NaN")
-        col4.metric("Max Drawdown", f"{max_drawdown*100:.2f}%" if not pd.isna(max_drawdown) else "NaN")
+                data = (prices, dates, asset_returns, pv_dates, returns_digest)
+                st.session_state["last_data_key"] = data_key
+                st.session_state["last_data"] = data
 
-        st.write(f"Sharpe Ratio (assuming risk-free rate of 0): **{sharpe_ratio:.2f}**" if not pd.isna(sharpe_ratio) else f"Sharpe Ratio (assuming risk-free rate of 0): **NaN**")
+    if data is not None:
+        weight_panel(*data)